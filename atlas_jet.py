@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import time
 import json
+import math
+import fcntl
+import threading
 import board
 import adafruit_dht
 import paho.mqtt.client as mqtt
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from AtlasI2C import AtlasI2C
 from config import MQTTConfig, SensorConfig
 
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    _json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def _dumps(obj) -> bytes:
+        return _json_encode(obj).encode('utf-8')
+
 
 class Config:
     """Application configuration (deprecated - use config.py)"""
@@ -17,6 +30,8 @@ class Config:
     PORT = MQTTConfig.PORT
     DHT_PIN = SensorConfig.DHT_PIN
     DEFAULT_POLL_INTERVAL = SensorConfig.DEFAULT_POLL_INTERVAL
+    MAX_POLL_INTERVAL = SensorConfig.MAX_POLL_INTERVAL
+    DHT_READ_INTERVAL = SensorConfig.DHT_READ_INTERVAL
     SENSOR_NAME_MAPPING = SensorConfig.SENSOR_NAME_MAPPING
 
 
@@ -24,16 +39,18 @@ class MQTTPublisher:
     """MQTT client wrapper for publishing sensor data"""
 
     def __init__(self, broker_address: str, port: int):
-        self.client = mqtt.Client()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.client.on_connect = self._on_connect
         self.broker_address = broker_address
         self.port = port
+        # sensor_name -> (topic, payload head up to "value":)
+        self._topic_cache: Dict[str, Tuple[str, bytes]] = {}
 
-    def _on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if not reason_code.is_failure:
             print("✅ MQTT 브로커에 성공적으로 연결되었습니다.")
         else:
-            print(f"❌ MQTT 연결 실패, 리턴 코드: {rc}")
+            print(f"❌ MQTT 연결 실패, 리턴 코드: {reason_code}")
 
     def connect(self):
         """Connect to MQTT broker"""
@@ -52,24 +69,65 @@ class MQTTPublisher:
 
     def publish(self, sensor_name: str, value):
         """Publish sensor data to MQTT broker"""
-        topic = f"{MQTTConfig.TOPIC_ENVIRONMENT_PREFIX}/{sensor_name.lower()}"
-        payload = {
-            "pattern": topic,
-            "data": {
-                "name": sensor_name.lower(),
-                "value": value
-            }
-        }
-        result = self.client.publish(topic, json.dumps(payload))
-        if result[0] != 0:
-            print(f"⚠️ MQTT 메시지 발행 실패: {result}")
+        self.publish_many([(sensor_name, value)])
+
+    def publish_many(self, items: List[Tuple[str, object]]):
+        """
+        Publish a batch of (sensor_name, value) readings in one pass.
+        Messages are queued back-to-back so the network thread drains
+        them together on its next wake-up.
+        """
+        dumps = _dumps
+        isfinite = math.isfinite
+        publish = self.client.publish
+        cache = self._topic_cache
+
+        for sensor_name, value in items:
+            entry = cache.get(sensor_name)
+            if entry is None:
+                entry = cache[sensor_name] = self._build_topic(sensor_name)
+            topic, head = entry
+
+            # Numbers and bools are formatted directly; strings go through JSON
+            kind = type(value)
+            if kind is bool:
+                raw = b"true" if value else b"false"
+            elif kind is int or (kind is float and isfinite(value)):
+                raw = repr(value).encode()
+            else:
+                raw = dumps(value)
+            payload = head + raw + b"}}"
+            info = publish(topic, payload, qos=0, retain=False)
+            if info.rc:
+                print(f"⚠️ MQTT 메시지 발행 실패: {info.rc}")
+
+    @staticmethod
+    def _build_topic(sensor_name: str) -> Tuple[str, bytes]:
+        """Build the topic and payload head for a sensor name"""
+        name = sensor_name.lower()
+        topic = f"{MQTTConfig.TOPIC_ENVIRONMENT_PREFIX}/{name}"
+        head = b'{"pattern":' + _dumps(topic) + b',"data":{"name":' + _dumps(name) + b',"value":'
+        return topic, head
 
 
 class AtlasSensorManager:
     """Manager for Atlas Scientific I2C sensors"""
 
+    # ioctl request to select the slave address (from i2c-dev.h)
+    I2C_SLAVE = 0x703
+
     def __init__(self):
         self.devices = self._discover_devices()
+        # Sensor names resolved once at discovery, aligned with self.devices
+        self._sensor_names = [self._get_sensor_name(dev.moduletype) for dev in self.devices]
+        # Single held bus fd for the read requests; all Atlas devices share one bus
+        self._bus_fd = os.open(f"/dev/i2c-{AtlasI2C.DEFAULT_BUS}", os.O_WRONLY)
+
+    def close(self):
+        """Close the shared bus fd and all device handles"""
+        os.close(self._bus_fd)
+        for dev in self.devices:
+            dev.close()
 
     def _discover_devices(self) -> List[AtlasI2C]:
         """Discover and initialize all Atlas I2C devices"""
@@ -97,20 +155,31 @@ class AtlasSensorManager:
 
     def read_all(self) -> dict:
         """Read values from all Atlas sensors"""
-        results = {}
+        self.start_read()
+        time.sleep(AtlasI2C.LONG_TIMEOUT)
+        return self.collect_read()
 
+    def start_read(self):
+        """Request a reading from all Atlas sensors back-to-back on the shared bus fd"""
+        fd = self._bus_fd
+        ioctl = fcntl.ioctl
+        write = os.write
         for dev in self.devices:
-            dev.write("R")
+            ioctl(fd, self.I2C_SLAVE, dev.address)
+            write(fd, b"R\x00")
 
-        time.sleep(AtlasI2C.LONG_TIMEOUT)
+    def collect_read(self) -> dict:
+        """Collect readings requested by start_read (wait LONG_TIMEOUT first)"""
+        results = {}
+        rpartition = str.rpartition
+        partition = str.partition
 
-        for dev in self.devices:
+        for dev, sensor_name in zip(self.devices, self._sensor_names):
             response_str = dev.read()
             print(response_str)
 
             try:
-                value = response_str.split(':')[-1].strip().split('\x00')[0]
-                sensor_name = self._get_sensor_name(dev.moduletype)
+                value = partition(rpartition(response_str, ':')[2].strip(), '\x00')[0]
                 results[sensor_name] = value
             except (ValueError, IndexError) as err:
                 print(f"⚠️ Error reading {dev.moduletype}: {err}")
@@ -148,6 +217,23 @@ class DHT22Sensor:
             return None, None
 
 
+class LatestReading:
+    """Single-slot holder for the most recent (temperature, humidity, timestamp)"""
+
+    __slots__ = ("_value",)
+
+    def __init__(self):
+        self._value = (None, None, 0.0)
+
+    def put(self, temperature: float, humidity: float):
+        """Replace the slot with a new reading (one atomic reference swap)"""
+        self._value = (temperature, humidity, time.monotonic())
+
+    def get(self) -> Tuple[Optional[float], Optional[float], float]:
+        """Return the latest (temperature, humidity, monotonic timestamp)"""
+        return self._value
+
+
 class SensorMonitor:
     """Main application for monitoring and publishing sensor data"""
 
@@ -155,12 +241,16 @@ class SensorMonitor:
         self.mqtt_publisher = MQTTPublisher(Config.BROKER_ADDRESS, Config.PORT)
         self.atlas_manager = AtlasSensorManager()
         self.dht_sensor = DHT22Sensor(Config.DHT_PIN)
+        self._dht_slot = LatestReading()
+        self._stop_event = threading.Event()
+        self._dht_thread = threading.Thread(target=self._dht_loop, daemon=True)
 
     def start(self):
         """Start the sensor monitoring application"""
         print(">> Atlas Scientific I2C Sensor Monitor")
 
         self.mqtt_publisher.connect()
+        self._dht_thread.start()
 
         if self.atlas_manager.devices:
             self.atlas_manager.print_devices(self.atlas_manager.devices[0])
@@ -170,50 +260,90 @@ class SensorMonitor:
         except KeyboardInterrupt:
             print("\nProgram exiting.")
         finally:
+            self._stop_event.set()
+            self.atlas_manager.close()
             self.mqtt_publisher.disconnect()
 
     def _run_command_loop(self):
         """Main command loop"""
+        handlers = {
+            "POLL": self._handle_poll_command,
+            "LIST": self._handle_list_command,
+        }
+
         while True:
             user_cmd = input(">> Enter command: ")
 
-            if user_cmd.upper().strip().startswith("POLL"):
-                self._handle_poll_command(user_cmd)
-            elif user_cmd.upper().strip().startswith("LIST"):
-                if self.atlas_manager.devices:
-                    self.atlas_manager.print_devices(self.atlas_manager.devices[0])
+            key = user_cmd.split(',', 1)[0].strip().upper()
+            handler = handlers.get(key)
+            if handler:
+                handler(user_cmd)
+
+    def _handle_list_command(self, user_cmd: str):
+        """Handle LIST command to print discovered devices"""
+        if self.atlas_manager.devices:
+            self.atlas_manager.print_devices(self.atlas_manager.devices[0])
 
     def _handle_poll_command(self, user_cmd: str):
         """Handle POLL command to continuously read sensors"""
         cmd_list = user_cmd.split(',')
         delay_time = float(cmd_list[1]) if len(cmd_list) > 1 else Config.DEFAULT_POLL_INTERVAL
+        delay_time = max(delay_time, 0.0)
+        max_interval = max(delay_time, Config.MAX_POLL_INTERVAL)
+        # POLL,0 polls back-to-back on change; backing off from 0 would never grow,
+        # so unchanged readings back off from the default interval (at least 1s)
+        backoff_base = delay_time if delay_time > 0 else max(Config.DEFAULT_POLL_INTERVAL, 1.0)
+        # Consecutive polls with unchanged readings, fresh for every POLL command
+        stable_count = 0
+        last_values: Dict[str, object] = {}
+        # A DHT22 reading older than this is treated as a read error
+        max_age = 2 * max(delay_time, Config.DHT_READ_INTERVAL)
 
         try:
             while True:
                 print("\n------- Polling Sensors -------")
 
                 # Read Atlas sensors
-                atlas_data = self.atlas_manager.read_all()
-                for sensor_name, value in atlas_data.items():
-                    self.mqtt_publisher.publish(sensor_name, value)
+                readings = list(self.atlas_manager.read_all().items())
 
-                # Read DHT22 sensor
-                temperature, humidity = self.dht_sensor.read()
-                if temperature is not None and humidity is not None:
+                # Take the latest DHT22 reading from the background thread
+                temperature, humidity, timestamp = self._dht_slot.get()
+                if temperature is not None and time.monotonic() - timestamp < max_age:
                     print(f"Temp: {temperature}")
                     print(f"Humid: {humidity}")
-                    self.mqtt_publisher.publish("temperature", temperature)
-                    self.mqtt_publisher.publish("humidity", humidity)
+                    readings.append(("temperature", temperature))
+                    readings.append(("humidity", humidity))
                 else:
                     print("DHT22 Read Error.")
 
-                time.sleep(delay_time)
+                self.mqtt_publisher.publish_many(readings)
+
+                # Back off exponentially while nothing changes, snap back on any change
+                values = dict(readings)
+                if values == last_values:
+                    if backoff_base * 2 ** stable_count < max_interval:
+                        stable_count += 1
+                    sleep_time = min(backoff_base * 2 ** stable_count, max_interval)
+                else:
+                    stable_count = 0
+                    sleep_time = delay_time
+                last_values = values
+
+                time.sleep(sleep_time)
 
         except KeyboardInterrupt:
             print("\nContinuous polling stopped")
             if self.atlas_manager.devices:
                 self.atlas_manager.print_devices(self.atlas_manager.devices[0])
 
+    def _dht_loop(self):
+        """Poll the DHT22 at its own cadence and keep the latest reading"""
+        while not self._stop_event.is_set():
+            temperature, humidity = self.dht_sensor.read()
+            if temperature is not None and humidity is not None:
+                self._dht_slot.put(temperature, humidity)
+            self._stop_event.wait(Config.DHT_READ_INTERVAL)
+
 
 def main():
     monitor = SensorMonitor()
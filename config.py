@@ -68,6 +68,9 @@ class MQTTConfig:
     TOPIC_STATUS_PREFIX = "status"
     TOPIC_DEVICE_UPDATE = "device/update"  # 장비 추가/수정/삭제 알림
 
+    # 값이 그대로여도 current/* 를 재발행하는 주기 (초)
+    CURRENT_HEARTBEAT_SEC = float(os.getenv('CURRENT_HEARTBEAT', '30'))
+
     # Wildcard subscriptions
     SWITCH_WILDCARD = "switch/+"
 
@@ -77,7 +80,8 @@ class SerialConfig:
     # 환경변수로 포트가 지정되지 않으면 자동 스캔
     DEVICE = os.getenv('SERIAL_DEV', find_serial_port())
     BAUD_RATE = int(os.getenv('BAUD', '115200'))
-    TIMEOUT = 0
+    # 읽기 타임아웃 (초) - 데이터가 올 때까지 블로킹 대기
+    TIMEOUT = 0.1
     WRITE_TIMEOUT = 2
     # Arduino 리셋 방지
     DSRDTR = False
@@ -100,6 +104,10 @@ class SensorConfig:
     """센서 설정 (Atlas Jet)"""
     DHT_PIN = int(os.getenv('DHT_PIN', '26'))
     DEFAULT_POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '5.0'))
+    # 값이 변하지 않을 때 폴링 간격을 늘리는 상한 (초)
+    MAX_POLL_INTERVAL = float(os.getenv('MAX_POLL_INTERVAL', '60.0'))
+    # DHT22는 2초보다 자주 읽을 수 없음
+    DHT_READ_INTERVAL = float(os.getenv('DHT_READ_INTERVAL', '2.0'))
 
     # Atlas Scientific 센서 타입 매핑
     SENSOR_NAME_MAPPING = {
@@ -111,7 +119,7 @@ class SensorConfig:
 
 class LoggingConfig:
     """로깅 설정"""
-    LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LEVEL = os.getenv('LOG_LEVEL', 'WARNING')  # 메시지별 로그가 필요하면 INFO/DEBUG
     FORMAT = "%(asctime)s %(levelname)s: %(message)s"
 
 
@@ -39,6 +39,13 @@ struct DeviceInfo {
   int sensorPin;    // machine의 경우 currentPin, sensor의 경우 센서 입력 핀
 };
 
+// 바이너리 프레임: [0xA5][cmd][dev_id][val][crc], crc = cmd ^ dev_id ^ val
+// dev_id는 마지막 config의 devices 배열 인덱스
+#define FRAME_START 0xA5
+#define FRAME_LEN 5
+#define FRAME_CMD_SWITCH 0x01
+#define FRAME_CMD_CURRENT 0x02
+
 // 스마트팜 장비 딕셔너리
 #define MAX_DEVICES 10
 DeviceInfo devices[MAX_DEVICES];
@@ -48,6 +55,8 @@ int DEVICE_COUNT = 0;
 void processCommand(String cmd);
 void handleJsonCommand(String jsonMessage);
 void handleConfigCommand(DynamicJsonDocument& doc);
+void handleBinaryFrame(const uint8_t* frame);
+void setRelay(DeviceInfo* device, bool value);
 DeviceInfo* findDevice(String deviceName);
 void measureAndSendCurrent();
 void measureAndSendEnvironment();
@@ -63,13 +72,21 @@ void setup() {
 void loop() {
   // 1. 시리얼 포트에 데이터가 있는지 확인
   if (Serial.available() > 0) {
-    // 2. 개행문자('\n')를 만날 때까지 문자열을 한번에 읽어옵니다. (안정성 향상)
-    String command = Serial.readStringUntil('\n');
-    command.trim(); // 앞뒤 공백 제거
-    
-    // 3. 읽어온 명령어가 있다면 처리
-    if (command.length() > 0) {
-      processCommand(command);
+    if (Serial.peek() == FRAME_START) {
+      // 바이너리 프레임은 고정 길이로 읽음 (readBytes 타임아웃 내)
+      uint8_t frame[FRAME_LEN];
+      if (Serial.readBytes(frame, FRAME_LEN) == FRAME_LEN) {
+        handleBinaryFrame(frame);
+      }
+    } else {
+      // 2. 개행문자('\n')를 만날 때까지 문자열을 한번에 읽어옵니다. (안정성 향상)
+      String command = Serial.readStringUntil('\n');
+      command.trim(); // 앞뒤 공백 제거
+
+      // 3. 읽어온 명령어가 있다면 처리
+      if (command.length() > 0) {
+        processCommand(command);
+      }
     }
   }
 
@@ -117,12 +134,7 @@ void handleJsonCommand(String jsonMessage) {
 
     DeviceInfo* device = findDevice(deviceName);
     if (device != nullptr) {
-      if (device->type == "machine") {
-        digitalWrite(device->relayPin, value ? HIGH : LOW);
-        sendResponse("{\"status\":\"ok\",\"device\":\"" + deviceName + "\",\"value\":" + String(value ? "true" : "false") + "}");
-      } else {
-        sendResponse("{\"status\":\"error\",\"message\":\"device is not a machine: " + deviceName + "\"}");
-      }
+      setRelay(device, value);
     } else {
       sendResponse("{\"status\":\"error\",\"message\":\"unknown device: " + deviceName + "\"}");
     }
@@ -132,6 +144,39 @@ void handleJsonCommand(String jsonMessage) {
   sendResponse("{\"status\":\"error\",\"message\":\"unknown command: " + cmd + "\"}");
 }
 
+// 바이너리 프레임 처리 (switch 명령)
+void handleBinaryFrame(const uint8_t* frame) {
+  uint8_t cmd = frame[1];
+  uint8_t devId = frame[2];
+  uint8_t val = frame[3];
+
+  if ((uint8_t)(cmd ^ devId ^ val) != frame[4]) {
+    sendResponse("{\"status\":\"error\",\"message\":\"bad frame crc\"}");
+    return;
+  }
+
+  if (cmd == FRAME_CMD_SWITCH) {
+    if (devId < DEVICE_COUNT) {
+      setRelay(&devices[devId], val != 0);
+    } else {
+      sendResponse("{\"status\":\"error\",\"message\":\"unknown device id: " + String(devId) + "\"}");
+    }
+    return;
+  }
+
+  sendResponse("{\"status\":\"error\",\"message\":\"unknown frame cmd: " + String(cmd) + "\"}");
+}
+
+// machine 장비 릴레이 제어
+void setRelay(DeviceInfo* device, bool value) {
+  if (device->type == "machine") {
+    digitalWrite(device->relayPin, value ? HIGH : LOW);
+    sendResponse("{\"status\":\"ok\",\"device\":\"" + device->name + "\",\"value\":" + String(value ? "true" : "false") + "}");
+  } else {
+    sendResponse("{\"status\":\"error\",\"message\":\"device is not a machine: " + device->name + "\"}");
+  }
+}
+
 // config 명령 처리 (장비 동적 설정)
 void handleConfigCommand(DynamicJsonDocument& doc) {
   JsonArray devicesArray = doc["devices"];
@@ -179,7 +224,9 @@ void handleConfigCommand(DynamicJsonDocument& doc) {
     DEVICE_COUNT++;
   }
 
-  sendResponse("{\"status\":\"ok\",\"message\":\"config complete\",\"count\":" + String(DEVICE_COUNT) + "}");
+  // seq는 Pi가 보낸 값을 그대로 돌려줌 (Pi는 seq와 count가 맞을 때만 장비 인덱스를 교체)
+  long seq = doc["seq"] | 0L;
+  sendResponse("{\"cmd\":\"config_ack\",\"seq\":" + String(seq) + ",\"status\":\"ok\",\"message\":\"config complete\",\"count\":" + String(DEVICE_COUNT) + "}");
 }
 
 // 장비 딕셔너리에서 장비 찾기
@@ -204,14 +251,10 @@ void measureAndSendCurrent() {
 
     bool currentState = digitalRead(devices[i].sensorPin); // INPUT_PULLUP이므로 반전
 
-    DynamicJsonDocument currentDoc(128);
-    currentDoc["cmd"] = "current";
-    currentDoc["dev"] = devices[i].name;
-    currentDoc["val"] = currentState;
-
-    String currentData;
-    serializeJson(currentDoc, currentData);
-    sendResponse(currentData);
+    // 전류값은 바이너리 프레임으로 전송 (JSON 대비 약 8배 작음)
+    uint8_t frame[FRAME_LEN] = {FRAME_START, FRAME_CMD_CURRENT, (uint8_t)i, (uint8_t)(currentState ? 1 : 0), 0};
+    frame[4] = frame[1] ^ frame[2] ^ frame[3];
+    Serial.write(frame, FRAME_LEN);
   }
 }
 
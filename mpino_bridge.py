@@ -8,24 +8,41 @@ Behavior:
     {"cmd":"current","dev":"led","val":true|false}
     {"cmd":"switch","dev":"fan","val":true|false}
   These are published to:
-    current/<dev>  (payload: {"pattern":"current/<dev>","data":{"name":"<dev>","value":val}})
+    current/<dev>  (payload: {"pattern":"current/<dev>","data":{"name":"<dev>","value":val}}, retained)
     switch/<dev>   (payload: {"pattern":"switch/<dev>","data":{"name":"<dev>","value":val}})
+  current/switch can also travel as a 5-byte binary frame (see FRAME_START):
+    [0xA5][cmd][dev_id][val][crc]   dev_id = index in the last config acked by the MPINO, crc = cmd^dev_id^val
 
 Usage:
-  pip3 install paho-mqtt pyserial
+  pip3 install "paho-mqtt>=2.0" pyserial
   python3 mpino_pi_strict_bridge.py /dev/ttyUSB0 115200 localhost 1883
 """
 
-import sys, time, json, threading, queue, signal, logging, atexit
+import os, sys, time, json, re, base64, struct, selectors, threading, signal, logging, atexit
+import queue
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import serial
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import MQTTConfig, SerialConfig, LoggingConfig, BackendConfig
 import json
 logging.basicConfig(level=getattr(logging, LoggingConfig.LEVEL), format=LoggingConfig.FORMAT)
+log = logging.getLogger(__name__)
+log.setLevel(LoggingConfig.LEVEL)
+# 핫 패스의 debug 로그는 레벨이 꺼져 있으면 인자 생성 자체를 건너뜀
+_log_debug = log.isEnabledFor(logging.DEBUG)
+_log_info = log.isEnabledFor(logging.INFO)
 
-# 마지막 상태를 저장하여 변경사항만 출력
-last_states = {}
+# 마지막 상태를 저장하여 변경사항만 출력 (종류별로 분리, 키는 장비명)
+_switch_states = {}
+_current_states = {}
+_environment_states = {}
+
+# current 장비별 마지막 발행 시각 (heartbeat 판단용, monotonic)
+last_publish_ts = {}
 
 # Shutdown 플래그
 shutdown_flag = False
@@ -36,7 +53,7 @@ BAUD = SerialConfig.BAUD_RATE
 MQTT_HOST = MQTTConfig.HOST
 MQTT_PORT = MQTTConfig.PORT
 
-logging.info("Configuration: SERIAL_DEV=%s, BAUD=%d, MQTT_HOST=%s, MQTT_PORT=%d", SERIAL_DEV, BAUD, MQTT_HOST, MQTT_PORT)
+log.info("Configuration: SERIAL_DEV=%s, BAUD=%d, MQTT_HOST=%s, MQTT_PORT=%d", SERIAL_DEV, BAUD, MQTT_HOST, MQTT_PORT)
 
 MQTT_SWITCH_WILDCARD = MQTTConfig.SWITCH_WILDCARD
 TOPIC_CURRENT_PREFIX = MQTTConfig.TOPIC_CURRENT_PREFIX
@@ -45,205 +62,574 @@ TOPIC_ENVIRONMENT_PREFIX = MQTTConfig.TOPIC_ENVIRONMENT_PREFIX
 TOPIC_DEVICE_UPDATE = MQTTConfig.TOPIC_DEVICE_UPDATE
 TOPIC_RAW = "mpino/raw"
 STATUS_TOPIC = f"{MQTTConfig.TOPIC_STATUS_PREFIX}/mpino_bridge_strict"
+CURRENT_HEARTBEAT_SEC = MQTTConfig.CURRENT_HEARTBEAT_SEC
+
+# queue for outgoing serial lines (C 구현 SimpleQueue, Condition 없이 put/get)
+SER_TX_MAX = 200
+# 한 번의 write로 묶어 보낼 최대 줄 수 / 바이트 수
+SER_TX_BATCH_LINES = 16
+SER_TX_BATCH_BYTES = 4096
+ser_tx_q = queue.SimpleQueue()
+
+# MQTT 수신 메시지 큐 (paho 콜백 -> dispatch 스레드)
+mqtt_rx_q = queue.Queue(maxsize=1000)
+
+# serial -> MQTT 발행을 모으는 시간창 (초)과 최대 개수
+PUB_BATCH_WINDOW = 0.005
+PUB_BATCH_MAX = 32
 
-# queue for outgoing serial lines
-ser_tx_q = queue.Queue(maxsize=200)
+# 시리얼 I/O 스레드를 깨우기 위한 self-pipe (selector에 serial fd와 함께 등록)
+_wake_r, _wake_w = os.pipe()
+os.set_blocking(_wake_r, False)
+os.set_blocking(_wake_w, False)
 
 # Serial 객체를 전역으로 관리 (device update 핸들러에서 접근하기 위함)
 serial_port = None
 
+# 백엔드 HTTP 연결 재사용 (TCP/TLS keep-alive).
+# 장비 목록 GET만 연결 오류 시 backoff 재시도하고, POST(로그인/리포트)는 재시도 없는 세션으로 보냄
+# (urllib3는 연결 오류를 method와 상관없이 재시도하므로 세션을 분리)
+_session = requests.Session()
+_session.headers["User-Agent"] = "plantpoint-mpino-bridge"
+_http_adapter = HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.5, allowed_methods={"GET"}))
+_session.mount("http://", _http_adapter)
+_session.mount("https://", _http_adapter)
+_post_session = requests.Session()
+_post_session.headers["User-Agent"] = "plantpoint-mpino-bridge"
+
+# shutdown 시 리포트 전송 제한 시간 (connect, read) - off 상태 발행이 늦어지지 않도록 짧게
+SHUTDOWN_HTTP_TIMEOUT = (1.0, 2.0)
+
+# device/update 디바운스: 시간창 안에 들어온 여러 알림을 한 번의 fetch+config로 합침
+DEVICE_UPDATE_DEBOUNCE = 0.5
+_update_lock = threading.Lock()
+_update_timer = None
+_update_apply_lock = threading.Lock()  # fetch+config는 한 번에 하나씩 순서대로
+
+# MPINO가 config 처리를 마치면 {"cmd":"config_ack","seq":..,"count":..}로 응답.
+# I/O 스레드가 장비 인덱스를 교체한 뒤 set. send_config_to_mpino는 최대 이 시간만큼 대기함
+CONFIG_ACK_TIMEOUT = 2.0
+_config_ack_event = threading.Event()
+
+# 인증 토큰 캐시 (JWT exp 기준, 만료 TOKEN_REFRESH_MARGIN초 전까지 재사용)
+TOKEN_REFRESH_MARGIN = 30
+_token_cache = {"token": None, "exp": 0.0}
+
 # MQTT client
 import uuid
 client_id = f"mpino_pi_strict_bridge_{uuid.uuid4().hex[:8]}"
-client = mqtt.Client(client_id)
+client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5)
 client.will_set(STATUS_TOPIC, payload="offline", qos=0, retain=True)
-logging.info("MQTT Client ID: %s", client_id)
+log.info("MQTT Client ID: %s", client_id)
+
+
+# orjson이 있으면 사용하고, 없으면 표준 json으로 대체 (둘 다 bytes 반환)
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+    _json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def _dumps(obj):
+        return _json_encode(obj).encode('utf-8')
+
+
+# prefix별 캐시: dev -> (topic, payload head up to "value":)
+_topic_caches = {
+    TOPIC_CURRENT_PREFIX: {},
+    TOPIC_SWITCH_PREFIX: {},
+    TOPIC_ENVIRONMENT_PREFIX: {},
+}
+_current_topics = _topic_caches[TOPIC_CURRENT_PREFIX]
+_environment_topics = _topic_caches[TOPIC_ENVIRONMENT_PREFIX]
+
+# payload 고정 부분 (import 시 한 번만 생성)
+_HEAD_PATTERN_B = b'{"pattern":'
+_HEAD_NAME_B = b',"data":{"name":'
+_HEAD_VALUE_B = b',"value":'
+_PAYLOAD_TAIL_B = b"}}"
+
+
+def get_topic(prefix, dev):
+    """장비별 topic과 payload 앞부분을 캐시하여 반환"""
+    cache = _topic_caches[prefix]
+    entry = cache.get(dev)
+    if entry is None:
+        # paho는 topic을 str로만 받으므로 topic은 str, payload head는 bytes로 보관
+        topic = sys.intern(f"{prefix}/{dev}")
+        head = b"".join((_HEAD_PATTERN_B, _dumps(topic), _HEAD_NAME_B, _dumps(dev), _HEAD_VALUE_B))
+        entry = cache[dev] = (topic, head)
+    return entry
+
+
+def encode_value(val):
+    """payload의 value 부분을 bytes로 변환 (bool은 인코더 없이 바로)"""
+    if type(val) is bool:
+        return b"true" if val else b"false"
+    return _dumps(val)
+
 
+# MPINO 바이너리 프레임: [0xA5][cmd][dev_id][val][crc], crc = cmd ^ dev_id ^ val
+FRAME_START = 0xA5
+FRAME_LEN = 5
+FRAME_CMD_SWITCH = 0x01
+FRAME_CMD_CURRENT = 0x02
+_FRAME = struct.Struct("<BBBBB")
 
-def safe_json_loads(s):
+# MPINO가 적용한 config 기준 장비 인덱스 (MPINO devices[] 순서와 동일).
+# seq와 count가 맞는 config_ack를 받은 뒤에만 바뀜. ack 대기 중에는 _DEV_IDS를 비워서
+# switch 명령이 장비명 기반 JSON으로 나가게 함 (인덱스가 다른 릴레이에 적용되는 것 방지)
+_DEV_IDS = {}
+_DEV_NAMES = []
+_dev_index_lock = threading.Lock()
+_config_seq = 0
+_pending_config = None  # ack 대기 중인 (seq, 장비명 목록)
+
+
+def build_frame(cmd, dev_id, val):
+    """바이너리 프레임 생성"""
+    val = 1 if val else 0
+    return _FRAME.pack(FRAME_START, cmd, dev_id, val, cmd ^ dev_id ^ val)
+
+
+# switch/<dev> 토픽 판별 및 장비명 추출용
+_SWITCH_TOPIC_PREFIX = TOPIC_SWITCH_PREFIX + "/"
+# current/* 는 모두 retain으로 발행 (다음 값이 shutdown 때 남긴 off를 덮어씀)
+_CURRENT_TOPIC_PREFIX = TOPIC_CURRENT_PREFIX + "/"
+_SWITCH_TOPIC_PREFIX_LEN = len(_SWITCH_TOPIC_PREFIX)
+
+# MPINO로 보내는 switch 명령 (dev는 JSON 문자열로 인코딩해서 넣음)
+SWITCH_TMPL = b'{"cmd":"switch","dev":%s,"val":%s}\n'
+
+# switch payload에서 data.value만 빠르게 추출
+_SWITCH_VALUE_RE = re.compile(rb'"value"\s*:\s*(true|false)')
+
+
+# MPINO가 보내는 고정 형태의 JSON 줄 (ArduinoJson 직렬화 순서 그대로, 공백 없음)
+_SERIAL_LINE_RE = re.compile(rb'^\{"cmd":"(current|switch|environment)","dev":"([^"\\]+)","val":(true|false|-?\d+)\}$')
+_SERIAL_CMDS = {b"current": "current", b"switch": "switch", b"environment": "environment"}
+
+
+def safe_json_loads(s, _l=_loads):
+    # _l는 기본 인자로 묶어서 호출마다 전역 조회를 하지 않음
     try:
-        return json.loads(s)
+        return _l(s)
     except Exception:
         return None
 
-def on_mqtt_connect(c, userdata, flags, rc):
-    logging.info("MQTT connected rc=%s", rc)
+# MQTT v5 topic alias: 연결마다 브로커가 허용한 개수(TopicAliasMaximum)까지 할당.
+# 처음 한 번은 topic과 alias를 같이 보내고, 이후에는 빈 topic + alias만 보냄
+_topic_alias_max = 0
+_topic_aliases = {}  # topic -> PUBLISH Properties (TopicAlias 설정됨)
+
+
+def publish_many(items):
+    """(topic, payload) 목록을 한 번에 발행 (alias가 있는 topic은 이름 없이)"""
+    publish = client.publish
+    retained_prefix = _CURRENT_TOPIC_PREFIX
+    for topic, payload in items:
+        retain = topic.startswith(retained_prefix)
+        # 배치 도중 재연결될 수 있으므로 alias 표는 발행할 때마다 다시 읽음
+        aliases = _topic_aliases
+        props = aliases.get(topic)
+        if props is not None:
+            info = publish("", payload, qos=0, retain=retain, properties=props)
+        elif len(aliases) < _topic_alias_max:
+            props = Properties(PacketTypes.PUBLISH)
+            props.TopicAlias = len(aliases) + 1
+            info = publish(topic, payload, qos=0, retain=retain, properties=props)
+            if not info.rc:
+                aliases[topic] = props  # 브로커가 alias를 받은 뒤부터 사용
+        else:
+            info = publish(topic, payload, qos=0, retain=retain)
+        if info.rc:
+            log.warning("MQTT publish failed on %s: rc=%s", topic, info.rc)
+
+def on_mqtt_connect(c, userdata, flags, reason_code, properties):
+    global _topic_aliases, _topic_alias_max
+    log.info("MQTT connected rc=%s", reason_code)
+    # topic alias는 연결 단위이므로 새 연결마다 처음부터 다시 할당
+    _topic_aliases = {}
+    _topic_alias_max = getattr(properties, "TopicAliasMaximum", 0)
+    # 재연결 시 다음 current 값은 변경 여부와 상관없이 발행
+    last_publish_ts.clear()
     c.publish(STATUS_TOPIC, "online", retain=True)
     c.subscribe(MQTT_SWITCH_WILDCARD)
     c.subscribe(TOPIC_DEVICE_UPDATE)
-    logging.info("Subscribed to %s and %s", MQTT_SWITCH_WILDCARD, TOPIC_DEVICE_UPDATE)
+    log.info("Subscribed to %s and %s", MQTT_SWITCH_WILDCARD, TOPIC_DEVICE_UPDATE)
+
+def on_mqtt_disconnect(c, userdata, flags, reason_code, properties):
+    global _topic_aliases, _topic_alias_max
+    # 끊어진 세션의 alias는 새 세션에서 쓸 수 없으므로 연결 전까지 alias 없이 발행
+    _topic_alias_max = 0
+    _topic_aliases = {}
+    log.warning("MQTT disconnected rc=%s", reason_code)
 
 def on_mqtt_message(c, userdata, msg):
-    payload = msg.payload.decode('utf-8', errors='ignore').strip()
-    logging.info("MQTT recv on %s: %s", msg.topic, payload)
+    # paho 네트워크 스레드는 큐에 넣기만 하고, 파싱/처리는 dispatch 스레드에서
+    topic = msg.topic
+    if topic != TOPIC_DEVICE_UPDATE and not topic.startswith(_SWITCH_TOPIC_PREFIX):
+        return  # 처리하지 않는 토픽은 큐에 넣지도 않음
+    try:
+        mqtt_rx_q.put_nowait((topic, msg.payload))
+    except queue.Full:
+        log.error("MQTT inbound queue full - dropping message on %s", msg.topic)
+
+def mqtt_dispatch_loop():
+    """수신한 MQTT 메시지를 꺼내서 처리"""
+    get = mqtt_rx_q.get
+    dispatch = dispatch_mqtt_message
+    while not shutdown_flag:
+        try:
+            topic, payload = get(timeout=0.5)
+        except queue.Empty:
+            continue
+        try:
+            dispatch(topic, payload)
+        except Exception as e:
+            log.exception("MQTT dispatch error: %s", e)
 
+def dispatch_mqtt_message(topic, payload):
+    """MQTT 메시지 한 건을 처리 (dispatch 스레드에서 실행)"""
     # device/update 토픽 처리
-    if msg.topic == TOPIC_DEVICE_UPDATE:
+    if topic == TOPIC_DEVICE_UPDATE:
+        log.info("MQTT recv on %s: %s", topic, payload)
         handle_device_update(payload)
         return
 
-    j = safe_json_loads(payload)
-    if not isinstance(j, dict):
-        logging.warning("Ignored: payload is not JSON object")
-        return
-
-    # {"pattern":"switch/<dev>","data":{"name":"<dev>","value":true|false}} 형식만 처리
-    pattern = j.get("pattern")
-    data = j.get("data")
-
-    if not (isinstance(pattern, str) and isinstance(data, dict)):
-        logging.warning("Ignored: missing or invalid pattern/data")
-        return
-
-    if not pattern.startswith("switch/"):
-        logging.warning("Ignored: pattern not switch/*")
+    # on_mqtt_message에서 switch/* 만 통과시키므로 장비명은 topic에서 바로 추출
+    name = topic[_SWITCH_TOPIC_PREFIX_LEN:]
+    if not name:
+        log.warning("Ignored: empty device name in %s", topic)
         return
-
-    name = data.get("name")
-    val = data.get("value")
-    if not isinstance(name, str) or not isinstance(val, bool):
-        logging.warning("Ignored: data.name must be string and data.value must be boolean")
-        return
-
-    # MPINO로 switch 명령 전송
-    out_obj = {"cmd":"switch", "dev": name, "val": val}
-    line = json.dumps(out_obj) + "\n"
+    if _log_debug:
+        log.debug("MQTT recv on %s: %s", topic, payload)
+    elif _log_info:
+        log.info("MQTT recv on %s", topic)
+
+    # {"pattern":"switch/<dev>","data":{"name":"<dev>","value":true|false}} 에서 value만 필요
+    m = _SWITCH_VALUE_RE.search(payload)
+    if m is not None:
+        val = m.group(1) == b"true"
+    else:
+        j = safe_json_loads(payload)
+        data = j.get("data") if isinstance(j, dict) else None
+        val = data.get("value") if isinstance(data, dict) else None
+        if not isinstance(val, bool):
+            log.warning("Ignored: data.value must be boolean")
+            return
+
+    # MPINO로 switch 명령 전송 (config에 있는 장비는 바이너리 프레임, 아니면 JSON).
+    # 인덱스 조회와 큐 추가를 lock 안에서 한 번에 해서, 새 config 줄보다 뒤에
+    # 이전 인덱스로 만든 프레임이 들어가는 일이 없게 함
+    with _dev_index_lock:
+        dev_id = _DEV_IDS.get(name)
+        if dev_id is not None:
+            line = build_frame(FRAME_CMD_SWITCH, dev_id, val)
+        else:
+            line = SWITCH_TMPL % (_dumps(name), b"true" if val else b"false")
+        queued = enqueue_serial(line)
+    if queued and _log_info:
+        log.info("Enqueued to serial: %s", line.strip())
+
+def enqueue_serial(line):
+    """시리얼 전송 큐에 추가하고 I/O 스레드를 깨움"""
+    if ser_tx_q.qsize() >= SER_TX_MAX:
+        log.error("Serial queue full - dropping command")
+        return False
+    ser_tx_q.put(line)
     try:
-        ser_tx_q.put_nowait(line)
-        logging.info("Enqueued to serial: %s", line.strip())
-    except queue.Full:
-        logging.error("Serial queue full - dropping command")
-
-def serial_reader_loop(ser):
-    global shutdown_flag, SERIAL_DEV
-    buf = ""
+        os.write(_wake_w, b"\0")
+    except BlockingIOError:
+        pass  # 깨우기 신호가 이미 충분히 쌓여 있음
+    return True
+
+def serial_io_loop(ser):
+    """시리얼 읽기/쓰기를 하나의 스레드에서 처리 (selector로 readable 시에만 깨어남)"""
+    global shutdown_flag, serial_port
+    sel = selectors.DefaultSelector()  # Linux에서는 epoll
+    sel.register(_wake_r, selectors.EVENT_READ)
+    ser_fd = ser.fileno()
+    sel.register(ser_fd, selectors.EVENT_READ)
+
+    buf = bytearray()
+    # 루프 안에서 반복 호출하는 함수는 지역 이름으로 묶어 둠
+    process = process_serial_line
+    process_frame = process_serial_frame
+    monotonic = time.monotonic
+    select = sel.select
+    tx_empty = ser_tx_q.empty
+    outbox = []           # 발행 대기 중인 (topic, payload)
+    outbox_since = 0.0    # outbox에 첫 항목이 들어온 시각
     while not shutdown_flag:
         try:
-            data = ser.read(ser.in_waiting or 1)
-            if not data:
-                time.sleep(0.01)
-                continue
-            logging.debug("Raw serial data received: %s", data)  # 원시 데이터 로깅
-            try:
-                s = data.decode('utf-8', errors='ignore')
-            except Exception:
-                s = ''.join(chr(b) for b in data)
-            buf += s
-            while '\n' in buf:
-                line, buf = buf.split('\n', 1)
-                line = line.strip()
-                if not line:
+            timeout = 1.0
+            if not tx_empty():
+                timeout = 0.0  # 아직 보내지 못한 명령이 남아 있음
+            elif outbox:
+                timeout = max(0.0, outbox_since + PUB_BATCH_WINDOW - monotonic())
+            for key, _ in select(timeout):
+                if key.fd == _wake_r:
+                    try:
+                        os.read(_wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                data = ser.read(ser.in_waiting or 1)
+                if not data:
                     continue
-                logging.info("Serial recv: %s", line)  # debug → info로 변경
-                process_serial_line(line)
+                if _log_debug:
+                    log.debug("Raw serial data received: %s", data)  # 원시 데이터 로깅
+                buf.extend(data)
+                pending = len(outbox)
+                while buf:
+                    # 바이너리 프레임은 개행 없이 고정 길이로 처리
+                    if buf[0] == FRAME_START:
+                        if len(buf) < FRAME_LEN:
+                            break
+                        frame = bytes(buf[:FRAME_LEN])
+                        del buf[:FRAME_LEN]
+                        process_frame(frame, outbox)
+                        continue
+                    idx = buf.find(b'\n')
+                    if idx < 0:
+                        break
+                    # JSON 파서가 bytes를 바로 받으므로 디코딩하지 않음
+                    line = bytes(buf[:idx]).strip()
+                    del buf[:idx + 1]
+                    if not line:
+                        continue
+                    if _log_info:
+                        log.info("Serial recv: %s", line)
+                    process(line, outbox)
+                if not pending and outbox:
+                    outbox_since = monotonic()
+
+            # 발행은 짧은 시간창(또는 최대 개수) 단위로 모아서 한 번에 처리
+            if outbox and (len(outbox) >= PUB_BATCH_MAX or
+                           monotonic() - outbox_since >= PUB_BATCH_WINDOW):
+                publish_many(outbox)
+                outbox.clear()
+
+            # 대기 중인 명령을 모두 모아 한 번에 전송 (flush 없이 OS 버퍼에 맡김)
+            if not tx_empty():
+                chunks = []
+                size = 0
+                while len(chunks) < SER_TX_BATCH_LINES and size < SER_TX_BATCH_BYTES:
+                    try:
+                        line = ser_tx_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    chunks.append(line)
+                    size += len(line)
+                data = b"".join(chunks)
+                if _log_info:
+                    log.info("Serial send (%d lines): %s", len(chunks), data.strip())
+                ser.write(data)
+        except (serial.SerialException, OSError) as e:
+            if shutdown_flag:
+                break
+            log.exception("Serial I/O error: %s", e)
+            new_ser = reopen_serial(ser)
+            if new_ser is not ser:
+                try:
+                    sel.unregister(ser_fd)
+                except (KeyError, ValueError):
+                    pass
+                ser = serial_port = new_ser
+                ser_fd = ser.fileno()
+                sel.register(ser_fd, selectors.EVENT_READ)
+                buf.clear()
         except Exception as e:
             if shutdown_flag:
                 break
-            logging.exception("Serial reader error: %s", e)
+            log.exception("Serial I/O error: %s", e)
             time.sleep(1)
+    # shutdown: 아직 보내지 못한 명령을 마지막으로 한 번에 써서 flush 대상에 포함시킴
+    chunks = []
+    while True:
+        try:
+            chunks.append(ser_tx_q.get_nowait())
+        except queue.Empty:
+            break
+    if chunks:
+        try:
+            ser.write(b"".join(chunks))
+            log.info("Serial send on shutdown: %d lines", len(chunks))
+        except (serial.SerialException, OSError) as e:
+            log.error("Could not send %d queued serial lines on shutdown: %s", len(chunks), e)
+    sel.close()
+
+def process_serial_line(line, outbox):
+    """시리얼 한 줄(bytes)을 처리하고 발행할 (topic, payload)를 outbox에 추가"""
+
+    # 흔한 형태는 정규식으로 바로 추출하고, 그 외에만 JSON 파싱
+    m = _SERIAL_LINE_RE.match(line)
+    if m is not None:
+        cmd = _SERIAL_CMDS[m.group(1)]
+        dev = m.group(2).decode('utf-8', errors='replace')
+        raw = m.group(3)
+        val = True if raw == b"true" else False if raw == b"false" else int(raw)
+    else:
+        j = safe_json_loads(line)
+        if not isinstance(j, dict):
+            # ignore non-json lines (or publish to raw if you want)
+            log.warning("Ignored non-JSON serial line")
+            return
 
-def process_serial_line(line):
-    global last_states
-
-    j = safe_json_loads(line)
-    if not isinstance(j, dict):
-        # ignore non-json lines (or publish to raw if you want)
-        logging.warning("Ignored non-JSON serial line")
-        return
+        cmd = j.get("cmd")
+        dev = j.get("dev")
+        val = j.get("val")
 
-    cmd = j.get("cmd")
-    dev = j.get("dev")
-    val = j.get("val")
+        if cmd == "config_ack":
+            apply_config_ack(j.get("seq"), j.get("count"))
+            return
 
     if cmd == "current" and isinstance(dev, str):
-        # 전류값은 변경 여부 상관없이 바로 발행
-        state_key = f"current/{dev}"
-        last_states[state_key] = val
-        # MPINO 형식에 맞춰 발행: {"pattern":"current/dev","data":{"name":"dev","value":val}}
-        payload = {
-            "pattern": f"current/{dev}",
-            "data": {"name": dev, "value": val}
-        }
-        topic = f"{TOPIC_CURRENT_PREFIX}/{dev}"
-        client.publish(topic, json.dumps(payload))
-        logging.info("Published %s -> %s", topic, payload)
+        handle_current(dev, val, outbox)
         return
 
     if cmd == "switch" and isinstance(dev, str):
         # 상태 변경된 경우만 출력
-        state_key = f"switch/{dev}"
-        if last_states.get(state_key) != val:
-            last_states[state_key] = val
-            logging.info("Switch state from MPINO: %s = %s", dev, val)
-        else:
-            logging.debug("No change for switch %s (still %s)", dev, val)
+        if _switch_states.get(dev) != val:
+            _switch_states[dev] = val
+            log.info("Switch state from MPINO: %s = %s", dev, val)
+        elif _log_debug:
+            log.debug("No change for switch %s (still %s)", dev, val)
         return
 
     if cmd == "environment" and isinstance(dev, str):
         # 센서값은 변경 여부 상관없이 바로 발행
-        state_key = f"environment/{dev}"
-        last_states[state_key] = val
+        _environment_states[dev] = val
         # MPINO 형식에 맞춰 발행: {"pattern":"environment/dev","data":{"name":"dev","value":val}}
-        payload = {
-            "pattern": f"environment/{dev}",
-            "data": {"name": dev, "value": val}
-        }
-        topic = f"{TOPIC_ENVIRONMENT_PREFIX}/{dev}"
-        client.publish(topic, json.dumps(payload))
-        logging.info("Published %s -> %s", topic, payload)
+        topic, head = _environment_topics.get(dev) or get_topic(TOPIC_ENVIRONMENT_PREFIX, dev)
+        payload = b"".join((head, encode_value(val), _PAYLOAD_TAIL_B))
+        outbox.append((topic, payload))
+        if _log_debug:
+            log.debug("Published %s -> %s", topic, payload)
+        elif _log_info:
+            log.info("Published %s", topic)
         return
 
-    logging.warning("Ignored serial JSON with unknown/unsupported cmd: %s", cmd)
+    log.warning("Ignored serial JSON with unknown/unsupported cmd: %s", cmd)
+
+def apply_config_ack(seq, count):
+    """config_ack가 대기 중인 config와 맞으면 장비 인덱스를 새 배치로 교체 (I/O 스레드에서 실행)"""
+    global _DEV_IDS, _DEV_NAMES, _pending_config
+    with _dev_index_lock:
+        pending = _pending_config
+        if pending is None or pending[0] != seq:
+            log.warning("Ignored config_ack with unexpected seq %s", seq)
+            return
+        _pending_config = None
+        names = pending[1]
+        if count == len(names):
+            _DEV_NAMES = names
+            _DEV_IDS = {name: i for i, name in enumerate(names)}
+            log.info("MPINO config applied: %d devices", count)
+            clear_removed_currents(_DEV_IDS)
+        else:
+            # MPINO는 MAX_DEVICES에서 잘라서 앞쪽만 적용하므로 current 프레임 해석은 그 기준으로.
+            # switch는 계속 장비명 기반 JSON으로 보냄
+            if isinstance(count, int) and 0 <= count < len(names):
+                _DEV_NAMES = names[:count]
+            log.error("MPINO applied %s of %d devices - switch frames disabled", count, len(names))
+    _config_ack_event.set()
+
+def clear_removed_currents(devices):
+    """config에서 빠진 장비의 retained current 값을 빈 payload로 지움 (I/O 스레드에서 실행)"""
+    for dev in [dev for dev in _current_states if dev not in devices]:
+        topic, _ = get_topic(TOPIC_CURRENT_PREFIX, dev)
+        client.publish(topic, b"", qos=0, retain=True)
+        del _current_states[dev]
+        last_publish_ts.pop(dev, None)
+        log.info("Cleared retained %s (device removed)", topic)
+
+def process_serial_frame(frame, outbox):
+    """MPINO 바이너리 프레임 한 개를 처리"""
+    _, cmd, dev_id, val, crc = _FRAME.unpack(frame)
+    if crc != cmd ^ dev_id ^ val:
+        log.warning("Ignored serial frame with bad crc: %s", frame.hex())
+        return
+    if dev_id >= len(_DEV_NAMES):
+        log.warning("Ignored serial frame for unknown device id %d", dev_id)
+        return
+    if cmd == FRAME_CMD_CURRENT:
+        handle_current(_DEV_NAMES[dev_id], bool(val), outbox)
+        return
+    log.warning("Ignored serial frame with unsupported cmd: %d", cmd)
+
+def handle_current(dev, val, outbox):
+    """전류값은 변경되었거나 heartbeat 주기가 지난 경우에만 발행"""
+    now = time.monotonic()
+    last_ts = last_publish_ts.get(dev)
+    if last_ts is not None and _current_states.get(dev) == val \
+            and now - last_ts < CURRENT_HEARTBEAT_SEC:
+        return
+    _current_states[dev] = val
+    last_publish_ts[dev] = now
+    # MPINO 형식에 맞춰 발행: {"pattern":"current/dev","data":{"name":"dev","value":val}}
+    topic, head = _current_topics.get(dev) or get_topic(TOPIC_CURRENT_PREFIX, dev)
+    payload = b"".join((head, encode_value(val), _PAYLOAD_TAIL_B))
+    outbox.append((topic, payload))
+    if _log_debug:
+        log.debug("Published %s -> %s", topic, payload)
+    elif _log_info:
+        log.info("Published %s", topic)
+
+def reopen_serial(ser):
+    """시리얼 연결이 끊어진 경우 포트를 다시 스캔하여 새 연결을 반환 (없으면 기존 객체)"""
+    global SERIAL_DEV
+    log.info("Serial I/O failed, scanning for new port...")
+    available_ports = SerialConfig.get_available_ports()
+    log.info("Available ports: %s", available_ports)
+
+    if not available_ports:
+        log.warning("No serial ports available, retrying in 5 seconds...")
+        time.sleep(5)
+        return ser
+
+    new_port = SerialConfig.refresh_device()
+    if new_port == SERIAL_DEV:
+        log.warning("No new port found, retrying in 5 seconds...")
+        time.sleep(5)
+        return ser
+
+    log.info("Found new port: %s (was %s)", new_port, SERIAL_DEV)
+    SERIAL_DEV = new_port
+    # 새로운 시리얼 연결 시도
+    try:
+        ser.close()
+    except:
+        pass
+    ser = serial.Serial(
+        SERIAL_DEV,
+        BAUD,
+        timeout=SerialConfig.TIMEOUT,
+        write_timeout=SerialConfig.WRITE_TIMEOUT,
+        dsrdtr=SerialConfig.DSRDTR,
+        rtscts=SerialConfig.RTSCTS
+    )
+    log.info("Reconnected to serial %s @ %d", SERIAL_DEV, BAUD)
+    return ser
+
+def _jwt_exp(token):
+    """JWT payload의 exp 클레임을 읽음 (서명 검증 없음, 실패 시 0)"""
+    try:
+        segment = token.split('.')[1]
+        segment += '=' * (-len(segment) % 4)
+        return float(_loads(base64.urlsafe_b64decode(segment)).get('exp', 0))
+    except Exception:
+        return 0.0
 
-def serial_writer_loop(ser):
-    global shutdown_flag, SERIAL_DEV
-    while not shutdown_flag:
-        try:
-            line = ser_tx_q.get(timeout=0.5)
-            if line is None:
-                continue
-            logging.info("Serial send: %s", line.strip())
-            ser.write(line.encode('utf-8'))
-        except queue.Empty:
-            continue
-        except Exception as e:
-            if shutdown_flag:
-                break
-            logging.exception("Serial write error: %s", e)
-            
-            # 시리얼 연결이 끊어진 경우 포트를 다시 스캔
-            logging.info("Serial write failed, scanning for new port...")
-            available_ports = SerialConfig.get_available_ports()
-            logging.info("Available ports: %s", available_ports)
-            
-            if available_ports:
-                new_port = SerialConfig.refresh_device()
-                if new_port != SERIAL_DEV:
-                    logging.info("Found new port: %s (was %s)", new_port, SERIAL_DEV)
-                    SERIAL_DEV = new_port
-                    # 새로운 시리얼 연결 시도
-                    try:
-                        ser.close()
-                    except:
-                        pass
-                    ser = serial.Serial(
-                        SERIAL_DEV,
-                        BAUD,
-                        timeout=SerialConfig.TIMEOUT,
-                        write_timeout=SerialConfig.WRITE_TIMEOUT,
-                        dsrdtr=SerialConfig.DSRDTR,
-                        rtscts=SerialConfig.RTSCTS
-                    )
-                    logging.info("Reconnected to serial %s @ %d", SERIAL_DEV, BAUD)
-                else:
-                    logging.warning("No new port found, retrying in 5 seconds...")
-                    time.sleep(5)
-            else:
-                logging.warning("No serial ports available, retrying in 5 seconds...")
-                time.sleep(5)
+def get_auth_token(timeout=10):
+    """백엔드에서 인증 토큰을 가져옴 (만료 전까지 캐시된 토큰 재사용)"""
+    if _token_cache["token"] and time.time() < _token_cache["exp"] - TOKEN_REFRESH_MARGIN:
+        return _token_cache["token"]
 
-def get_auth_token():
-    """백엔드에서 인증 토큰을 가져옴"""
     try:
         signin_url = f"{BackendConfig.BASE_URL}/authentication/signin"
         auth_data = {
@@ -251,22 +637,24 @@ def get_auth_token():
             'password': BackendConfig.PASSWORD
         }
         
-        logging.info("Getting auth token from: %s", signin_url)
-        response = requests.post(signin_url, json=auth_data, timeout=10)
+        log.info("Getting auth token from: %s", signin_url)
+        response = _post_session.post(signin_url, json=auth_data, timeout=timeout)
         response.raise_for_status()
         
         token_data = response.json()
         access_token = token_data.get('accessToken')
         
         if not access_token:
-            logging.error("No access token in response")
+            log.error("No access token in response")
             return None
             
-        logging.info("Successfully obtained auth token")
+        _token_cache["token"] = access_token
+        _token_cache["exp"] = _jwt_exp(access_token)
+        log.info("Successfully obtained auth token")
         return access_token
         
     except Exception as e:
-        logging.exception("Error getting auth token: %s", e)
+        log.exception("Error getting auth token: %s", e)
         return None
 
 def fetch_devices_from_backend():
@@ -275,33 +663,33 @@ def fetch_devices_from_backend():
         # 인증 토큰 가져오기
         token = get_auth_token()
         if not token:
-            logging.error("Failed to get auth token")
+            log.error("Failed to get auth token")
             return []
 
         # 인증 헤더 설정
         headers = {'Authorization': f'Bearer {token}'}
 
         devices_url = f"{BackendConfig.BASE_URL}{BackendConfig.DEVICES_ENDPOINT}"
-        logging.info("Fetching devices from backend: %s", devices_url)
-        response = requests.get(devices_url, headers=headers, timeout=10)
+        log.info("Fetching devices from backend: %s", devices_url)
+        response = _session.get(devices_url, headers=headers, timeout=10)
 
         if response.status_code == 200:
             all_devices = response.json()
             # type이 'machine'이거나 name이 'waterlevel'인 센서만 필터링
             filtered_devices = [d for d in all_devices if d.get('type') == 'machine' or d.get('name') == 'waterlevel']
-            logging.info("Fetched %d devices (machines + waterlevel) from backend (total: %d)", len(filtered_devices), len(all_devices))
+            log.info("Fetched %d devices (machines + waterlevel) from backend (total: %d)", len(filtered_devices), len(all_devices))
 
             # Current 센서 정보 조회 (인증 불필요)
             currents_url = f"{BackendConfig.BASE_URL}{BackendConfig.CURRENTS_ENDPOINT}"
-            logging.info("Fetching currents from backend: %s", currents_url)
-            currents_response = requests.get(currents_url, timeout=10)
+            log.info("Fetching currents from backend: %s", currents_url)
+            currents_response = _session.get(currents_url, timeout=10)
 
             currents_data = []
             if currents_response.status_code == 200:
                 currents_data = currents_response.json()
-                logging.info("Fetched %d current sensors from backend", len(currents_data))
+                log.info("Fetched %d current sensors from backend", len(currents_data))
             else:
-                logging.warning("Failed to fetch currents: HTTP %d - %s", currents_response.status_code, currents_response.text)
+                log.warning("Failed to fetch currents: HTTP %d - %s", currents_response.status_code, currents_response.text)
 
             # 디바이스와 current/sensor 정보를 매칭하여 조합
             devices_data = []
@@ -323,9 +711,9 @@ def fetch_devices_from_backend():
                     sensor_pin = 0
                     if current_info and current_info.get('pin') is not None:
                         sensor_pin = current_info.get('pin')
-                        logging.info("Found current pin for %s: %d", device_name, sensor_pin)
+                        log.info("Found current pin for %s: %d", device_name, sensor_pin)
                     else:
-                        logging.warning("No current pin found for %s, using 0", device_name)
+                        log.warning("No current pin found for %s, using 0", device_name)
 
                     device_data = {
                         'id': device_id,
@@ -343,47 +731,72 @@ def fetch_devices_from_backend():
                         'relay_pin': 0,
                         'sensor_pin': device.get('pin', 0)
                     }
-                    logging.info("Found sensor %s with pin %d", device_name, device.get('pin', 0))
+                    log.info("Found sensor %s with pin %d", device_name, device.get('pin', 0))
 
                 devices_data.append(device_data)
 
-            logging.info("Combined %d devices (machines + sensors) with pin information", len(devices_data))
+            log.info("Combined %d devices (machines + sensors) with pin information", len(devices_data))
             return devices_data
         else:
-            logging.error("Failed to fetch devices: HTTP %d - %s", response.status_code, response.text)
+            log.error("Failed to fetch devices: HTTP %d - %s", response.status_code, response.text)
+            if response.status_code == 401:
+                # 캐시된 토큰이 거부되면 다음 호출에서 다시 로그인
+                _token_cache["token"] = None
             return []
     except Exception as e:
-        logging.exception("Error fetching devices from backend: %s", e)
+        log.exception("Error fetching devices from backend: %s", e)
         return []
 
 def handle_device_update(payload):
-    """device/update MQTT 메시지 처리"""
-    global serial_port
+    """device/update MQTT 메시지 처리 (DEVICE_UPDATE_DEBOUNCE 동안의 알림은 한 번으로 합침)"""
+    global _update_timer
 
-    logging.info("Device update notification received")
+    log.info("Device update notification received")
 
     j = safe_json_loads(payload)
     if not isinstance(j, dict):
-        logging.warning("Invalid device update payload: not JSON object")
-        return
-
-    # 백엔드에서 최신 장비 목록 가져오기 (인증 포함)
-    devices_data = fetch_devices_from_backend()
-
-    if not devices_data:
-        logging.warning("No machine devices found after update")
+        log.warning("Invalid device update payload: not JSON object")
         return
 
-    # MPINO에 config 전송
-    if serial_port:
-        send_config_to_mpino(serial_port, devices_data)
-    else:
-        logging.error("Serial port not available for device update")
+    with _update_lock:
+        if _update_timer is not None and _update_timer.is_alive():
+            log.info("Device update already scheduled - coalescing")
+            return
+        _update_timer = threading.Timer(DEVICE_UPDATE_DEBOUNCE, apply_device_update)
+        _update_timer.daemon = True
+        _update_timer.start()
+
+def apply_device_update():
+    """백엔드에서 최신 장비 목록을 가져와 MPINO에 config 전송 (디바운스 타이머에서 실행)"""
+    global _update_timer
+
+    # 지금부터 들어오는 알림은 새 타이머로 (fetch 중 변경도 놓치지 않음)
+    with _update_lock:
+        _update_timer = None
+
+    with _update_apply_lock:
+        # 백엔드에서 최신 장비 목록 가져오기 (인증 포함)
+        devices_data = fetch_devices_from_backend()
+
+        if not devices_data:
+            log.warning("No machine devices found after update")
+            return
+
+        # MPINO에 config 전송
+        if serial_port:
+            send_config_to_mpino(serial_port, devices_data)
+        else:
+            log.error("Serial port not available for device update")
 
 def send_config_to_mpino(ser, devices_data):
-    """MPINO에 config 명령을 전송하여 장비 설정"""
+    """
+    MPINO에 config 명령을 전송하여 장비 설정.
+    config_ack를 최대 CONFIG_ACK_TIMEOUT초 동안 기다리며(호출 스레드 블록),
+    MPINO가 모든 장비를 적용해 바이너리 프레임용 인덱스가 교체된 경우에만 True.
+    """
+    global _DEV_IDS, _config_seq, _pending_config
     if not devices_data:
-        logging.warning("No devices to configure")
+        log.warning("No devices to configure")
         return False
 
     # 백엔드 데이터를 MPINO config 형식으로 변환
@@ -391,13 +804,13 @@ def send_config_to_mpino(ser, devices_data):
     for device in devices_data:
         # 필수 필드 확인
         if not all(key in device for key in ['name', 'type', 'relay_pin', 'sensor_pin']):
-            logging.warning("Device missing required fields: %s", device)
+            log.warning("Device missing required fields: %s", device)
             continue
 
         # sensor_pin이 유효한 값인지 확인 (0은 허용)
         sensor_pin = device.get('sensor_pin')
         if sensor_pin is None:
-            logging.warning("Device %s has no sensor_pin, using 0", device['name'])
+            log.warning("Device %s has no sensor_pin, using 0", device['name'])
             sensor_pin = 0
 
         mpino_devices.append({
@@ -407,46 +820,62 @@ def send_config_to_mpino(ser, devices_data):
             "sensor": sensor_pin
         })
 
-        logging.info("Device %s (type=%s): relay=%d, sensor=%d",
+        log.info("Device %s (type=%s): relay=%d, sensor=%d",
                     device['name'], device['type'], device['relay_pin'], sensor_pin)
 
     if not mpino_devices:
-        logging.error("No valid devices to configure")
+        log.error("No valid devices to configure")
         return False
 
-    # config 명령 생성
-    config_cmd = {
-        "cmd": "config",
-        "devices": mpino_devices
-    }
-
-    config_line = json.dumps(config_cmd) + "\n"
+    # 새 장비 인덱스는 ack를 받을 때까지 보류하고, 그동안 switch는 장비명 기반 JSON으로 전송
+    # 인덱스 비우기와 config 줄 큐 추가는 switch 전송과 같은 lock 안에서 한 번에 처리
+    names = [d["name"] for d in mpino_devices]
+    with _dev_index_lock:
+        _config_seq = (_config_seq + 1) & 0xFFFF
+        seq = _config_seq
+
+        # config 명령 생성 (MPINO는 seq를 config_ack에 그대로 돌려줌)
+        config_cmd = {
+            "cmd": "config",
+            "seq": seq,
+            "devices": mpino_devices
+        }
 
-    # MPINO에 전송
-    try:
-        logging.info("Sending config to MPINO: %s", config_line.strip())
-        ser.write(config_line.encode('utf-8'))
-        
-        # MPINO 응답 확인
-        if ser.in_waiting > 0:
-            response = ser.read(ser.in_waiting).decode('utf-8', errors='ignore')
-            logging.info("MPINO response: %s", response.strip())
-        
-        logging.info("Config sent successfully")
-        return True
-    except Exception as e:
-        logging.exception("Failed to send config to MPINO: %s", e)
+        config_line = _dumps(config_cmd) + b"\n"
+
+        # 시리얼 I/O 스레드를 통해 전송하고 MPINO의 config_ack를 기다림
+        log.info("Sending config to MPINO: %s", config_line.strip())
+        if not enqueue_serial(config_line):
+            # 아무것도 보내지 않았으므로 MPINO는 이전 배치 그대로
+            log.error("Failed to send config to MPINO: serial queue full")
+            return False
+        _pending_config = (seq, names)
+        _DEV_IDS = {}
+        _config_ack_event.clear()
+    if not _config_ack_event.wait(CONFIG_ACK_TIMEOUT):
+        # config_ack를 보내지 않는 이전 펌웨어도 여기로 옴 (switch는 JSON으로 계속 동작)
+        log.warning("No config_ack from MPINO within %.1fs - switch commands stay on JSON "
+                    "(firmware without config_ack?)", CONFIG_ACK_TIMEOUT)
         return False
+    if _DEV_NAMES is not names:
+        return False
+    log.info("Config sent successfully")
+    return True
 
 def main():
     global serial_port
 
+    # MQTT 수신 메시지 처리 스레드
+    dsp = threading.Thread(target=mqtt_dispatch_loop, daemon=True)
+    dsp.start()
+
     client.on_connect = on_mqtt_connect
+    client.on_disconnect = on_mqtt_disconnect
     client.on_message = on_mqtt_message
     try:
         client.connect(MQTT_HOST, MQTT_PORT, 60)
     except Exception:
-        logging.exception("MQTT connect failed; will retry via loop_start")
+        log.exception("MQTT connect failed; will retry via loop_start")
     client.loop_start()
 
     # open serial
@@ -461,17 +890,17 @@ def main():
                 dsrdtr=SerialConfig.DSRDTR,
                 rtscts=SerialConfig.RTSCTS
             )
-            logging.info("Opened serial %s @ %d", SERIAL_DEV, BAUD)
+            log.info("Opened serial %s @ %d", SERIAL_DEV, BAUD)
             break
         except Exception as e:
-            logging.exception("Failed to open serial %s: %s", SERIAL_DEV, e)
+            log.exception("Failed to open serial %s: %s", SERIAL_DEV, e)
             time.sleep(2)
 
     # 전역 serial_port 설정 (device update 핸들러에서 사용)
     serial_port = ser
 
     # Arduino 초기화 완료 신호 대기
-    logging.info("Waiting for Arduino initialization signal...")
+    log.info("Waiting for Arduino initialization signal...")
     arduino_ready = False
     
     while not arduino_ready:
@@ -481,12 +910,12 @@ def main():
             for line in lines:
                 line = line.strip()
                 if line:
-                    logging.debug("Received during init: %s", line)
+                    log.debug("Received during init: %s", line)
                     # init_complete 신호 확인
                     try:
-                        msg = json.loads(line)
+                        msg = _loads(line)
                         if msg.get('cmd') == 'init_complete' and msg.get('status') == 'ready':
-                            logging.info("Arduino initialization completed - ready for config")
+                            log.info("Arduino initialization completed - ready for config")
                             arduino_ready = True
                             break
                     except:
@@ -495,17 +924,16 @@ def main():
                 break
         time.sleep(1)
     
+    # serial I/O thread (읽기/쓰기 통합, 이후 모든 시리얼 쓰기는 이 스레드에서만)
+    sio = threading.Thread(target=serial_io_loop, args=(ser,), daemon=True)
+    sio.start()
+
     # 백엔드에서 장비 정보 가져오기 및 MPINO 설정 (인증 포함)
     devices_data = fetch_devices_from_backend()
     if devices_data:
         send_config_to_mpino(ser, devices_data)
     else:
-        logging.warning("Starting without device configuration")
-
-    # threads
-    rdr = threading.Thread(target=serial_reader_loop, args=(ser,), daemon=True)
-    wtr = threading.Thread(target=serial_writer_loop, args=(ser,), daemon=True)
-    rdr.start(); wtr.start()
+        log.warning("Starting without device configuration")
 
     def shutdown(signum=None, frame=None):
         global shutdown_flag
@@ -513,12 +941,12 @@ def main():
             return  # 이미 shutdown 중이면 중복 실행 방지
         shutdown_flag = True
 
-        logging.info("Shutting down")
+        log.info("Shutting down")
 
         # Backend에 에러 리포트 전송 (인증 포함)
         try:
             # 인증 토큰 가져오기
-            token = get_auth_token()
+            token = get_auth_token(timeout=SHUTDOWN_HTTP_TIMEOUT)
             if token:
                 headers = {'Authorization': f'Bearer {token}'}
                 report_url = f"{BackendConfig.BASE_URL}{BackendConfig.REPORT_ENDPOINT}"
@@ -526,47 +954,39 @@ def main():
                     "level": 2,  # 경고 레벨
                     "problem": "MPINO Bridge 종료 - 릴레이 자동 차단됨"
                 }
-                response = requests.post(report_url, json=report_data, headers=headers, timeout=2)
+                response = _post_session.post(report_url, json=report_data, headers=headers,
+                                              timeout=SHUTDOWN_HTTP_TIMEOUT)
                 if response.status_code == 201:
-                    logging.info("Error report sent to backend successfully")
+                    log.info("Error report sent to backend successfully")
                 else:
-                    logging.warning("Failed to send error report: HTTP %d", response.status_code)
+                    log.warning("Failed to send error report: HTTP %d", response.status_code)
             else:
-                logging.warning("Could not get auth token for error report")
+                log.warning("Could not get auth token for error report")
         except Exception as e:
-            logging.error("Could not send error report to backend: %s", e)
-
-        # 모든 switch 상태를 false로 전송하여 릴레이 끄기
-        for state_key in last_states.keys():
-            if state_key.startswith("switch/"):
-                dev = state_key.replace("switch/", "")
-                payload = {
-                    "pattern": f"switch/{dev}",
-                    "data": {"name": dev, "value": False}
-                }
-                topic = f"{TOPIC_SWITCH_PREFIX}/{dev}"
-                try:
-                    client.publish(topic, json.dumps(payload))
-                    logging.info("Shutdown: Published %s -> %s", topic, payload)
-                except:
-                    pass
-
-        # 모든 current 상태를 false로 전송
-        for state_key in last_states.keys():
-            if state_key.startswith("current/"):
-                dev = state_key.replace("current/", "")
-                payload = {
-                    "pattern": f"current/{dev}",
-                    "data": {"name": dev, "value": False}
-                }
-                topic = f"{TOPIC_CURRENT_PREFIX}/{dev}"
+            log.error("Could not send error report to backend: %s", e)
+
+        # 모든 switch/current 상태를 false로 한 번에 전송 (캐시된 head + 고정 tail)
+        # current는 평소 발행처럼 retain (재시작 후 첫 current 값이 이 off를 덮어씀).
+        # switch는 bridge가 다시 구독하므로 retain하지 않음 (재연결 시 릴레이가 꺼지는 것 방지)
+        off_tail = b"false" + _PAYLOAD_TAIL_B
+        publish = client.publish
+        info = None
+        for prefix, states, retain in ((TOPIC_SWITCH_PREFIX, _switch_states, False),
+                                       (TOPIC_CURRENT_PREFIX, _current_states, True)):
+            for dev in states:
+                topic, head = get_topic(prefix, dev)
                 try:
-                    client.publish(topic, json.dumps(payload))
-                    logging.info("Shutdown: Published %s -> %s", topic, payload)
-                except:
+                    info = publish(topic, head + off_tail, qos=0, retain=retain)
+                except Exception:
                     pass
-
-        time.sleep(0.5)  # MQTT 메시지 전송 대기
+        # 마지막 메시지가 나가면 앞의 메시지도 모두 나간 것 (고정 0.5초 대기 대신)
+        if info is not None:
+            try:
+                info.wait_for_publish(timeout=0.5)
+            except Exception:
+                pass
+        log.info("Shutdown: Published off for %d switch and %d current topics",
+                 len(_switch_states), len(_current_states))
 
         try:
             client.publish(STATUS_TOPIC, "offline", retain=True)
@@ -574,14 +994,20 @@ def main():
             pass
         client.loop_stop()
 
-        # 스레드 종료 대기
-        time.sleep(0.5)
+        # 시리얼 I/O 스레드를 깨워서 남은 명령을 쓰고 끝날 때까지 대기
+        try:
+            os.write(_wake_w, b"\0")
+        except BlockingIOError:
+            pass
+        sio.join(2.0)
 
         try:
-            ser.close()
+            port = serial_port or ser  # 재연결된 경우 I/O 스레드가 바꾼 포트
+            port.flush()  # 남은 명령이 UART로 모두 나간 뒤 닫음
+            port.close()
         except:
             pass
-        logging.info("Shutdown complete")
+        log.info("Shutdown complete")
         sys.exit(0)
 
     signal.signal(signal.SIGINT, shutdown)
@@ -0,0 +1,206 @@
+import os
+import queue
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial
+
+import mpino_bridge as bridge
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+DEVICES = [
+    {"name": "fan", "type": "machine", "relay_pin": 62, "sensor_pin": 22},
+    {"name": "led", "type": "machine", "relay_pin": 63, "sensor_pin": 23},
+]
+
+
+def drain_tx():
+    lines = []
+    while True:
+        try:
+            lines.append(bridge.ser_tx_q.get_nowait())
+        except queue.Empty:
+            return lines
+
+
+def switch_payload(val):
+    return b'{"pattern":"switch/fan","data":{"name":"fan","value":%s}}' % (b"true" if val else b"false")
+
+
+class ConfigAckTest(unittest.TestCase):
+
+    def setUp(self):
+        drain_tx()
+        bridge._DEV_IDS = {"led": 0, "fan": 1}
+        bridge._DEV_NAMES = ["led", "fan"]
+        bridge._pending_config = None
+
+    def tearDown(self):
+        drain_tx()
+
+    def test_no_ack_keeps_old_index_out_of_switch_frames(self):
+        with mock.patch.object(bridge, "CONFIG_ACK_TIMEOUT", 0.01):
+            self.assertFalse(bridge.send_config_to_mpino(None, DEVICES))
+        self.assertEqual(len(drain_tx()), 1)  # config line only
+
+        # 인덱스는 바뀌지 않고, switch는 장비명 기반 JSON으로 나감
+        self.assertEqual(bridge._DEV_NAMES, ["led", "fan"])
+        bridge.dispatch_mqtt_message("switch/fan", switch_payload(True))
+        self.assertEqual(drain_tx(), [b'{"cmd":"switch","dev":"fan","val":true}\n'])
+
+    def test_matching_ack_commits_new_index(self):
+        with mock.patch.object(bridge, "CONFIG_ACK_TIMEOUT", 0.01):
+            bridge.send_config_to_mpino(None, DEVICES)
+        seq = bridge._pending_config[0]
+        bridge.process_serial_line(
+            b'{"cmd":"config_ack","seq":%d,"status":"ok","message":"config complete","count":2}' % seq, [])
+
+        self.assertEqual(bridge._DEV_NAMES, ["fan", "led"])
+        drain_tx()
+        bridge.dispatch_mqtt_message("switch/fan", switch_payload(True))
+        self.assertEqual(drain_tx(), [bridge.build_frame(bridge.FRAME_CMD_SWITCH, 0, True)])
+
+    def test_stale_or_short_ack_does_not_commit(self):
+        with mock.patch.object(bridge, "CONFIG_ACK_TIMEOUT", 0.01):
+            bridge.send_config_to_mpino(None, DEVICES)
+        seq = bridge._pending_config[0]
+        bridge.apply_config_ack(seq - 1, 2)
+        self.assertEqual(bridge._DEV_IDS, {})
+        bridge.apply_config_ack(seq, 1)
+        self.assertEqual(bridge._DEV_IDS, {})
+        self.assertEqual(bridge._DEV_NAMES, ["fan"])
+
+    def test_config_between_lookup_and_enqueue_queues_behind_frame(self):
+        build_frame = bridge.build_frame
+        config = threading.Thread(target=bridge.send_config_to_mpino, args=(None, DEVICES))
+
+        def build_then_config(*args):
+            # 이전 인덱스 조회가 끝난 뒤, 큐에 넣기 전에 config 전송을 끼워 넣음
+            config.start()
+            config.join(0.2)
+            return build_frame(*args)
+
+        with mock.patch.object(bridge, "CONFIG_ACK_TIMEOUT", 0.01), \
+                mock.patch.object(bridge, "build_frame", side_effect=build_then_config):
+            bridge.dispatch_mqtt_message("switch/fan", switch_payload(True))
+            config.join()
+
+        lines = drain_tx()
+        self.assertEqual(len(lines), 2)
+        # 이전 인덱스로 만든 프레임은 MPINO가 이전 배치로 적용하도록 config보다 먼저 나감
+        self.assertEqual(lines[0], build_frame(bridge.FRAME_CMD_SWITCH, 1, True))
+        self.assertTrue(lines[1].startswith(b'{"cmd":"config"'))
+
+
+
+class TopicAliasTest(unittest.TestCase):
+    TOPIC = "current/fan"
+
+    def setUp(self):
+        self.sent = []
+        publish = mock.patch.object(bridge.client, "publish", side_effect=self._publish)
+        publish.start()
+        self.addCleanup(publish.stop)
+        self.on_publish = None
+        self.connect()
+
+    def _publish(self, topic, payload, qos=0, retain=False, properties=None):
+        alias = getattr(properties, "TopicAlias", None) if properties is not None else None
+        self.sent.append((topic, alias))
+        if self.on_publish is not None:
+            self.on_publish()
+        return mock.Mock(rc=0)
+
+    def connect(self):
+        props = Properties(PacketTypes.CONNACK)
+        props.TopicAliasMaximum = 10
+        bridge.on_mqtt_connect(mock.Mock(), None, None, 0, props)
+
+    def disconnect(self):
+        bridge.on_mqtt_disconnect(mock.Mock(), None, None, 0, None)
+
+    def test_reconnect_between_publishes_resends_topic(self):
+        bridge.publish_many([(self.TOPIC, b"1")])
+        bridge.publish_many([(self.TOPIC, b"2")])
+        self.disconnect()
+        bridge.publish_many([(self.TOPIC, b"3")])
+        self.connect()
+        bridge.publish_many([(self.TOPIC, b"4")])
+        bridge.publish_many([(self.TOPIC, b"5")])
+
+        self.assertEqual(self.sent, [
+            (self.TOPIC, 1), ("", 1),      # 첫 세션
+            (self.TOPIC, None),            # 끊긴 동안에는 alias 없이
+            (self.TOPIC, 1), ("", 1),      # 새 세션에서 다시 할당
+        ])
+
+    def test_reconnect_inside_a_batch(self):
+        bridge.publish_many([(self.TOPIC, b"1")])
+
+        def reconnect():
+            self.on_publish = None
+            self.disconnect()
+            self.connect()
+        self.on_publish = reconnect
+        bridge.publish_many([(self.TOPIC, b"2"), (self.TOPIC, b"3")])
+
+        self.assertEqual(self.sent, [(self.TOPIC, 1), ("", 1), (self.TOPIC, 1)])
+
+
+class RetainedCurrentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        publish = mock.patch.object(bridge.client, "publish", side_effect=self._publish)
+        publish.start()
+        self.addCleanup(publish.stop)
+        bridge.on_mqtt_disconnect(mock.Mock(), None, None, 0, None)
+
+    def _publish(self, topic, payload, qos=0, retain=False, properties=None):
+        self.sent.append((topic, payload, retain))
+        return mock.Mock(rc=0)
+
+    def test_current_publishes_are_retained(self):
+        bridge.publish_many([("current/fan", b"1"), ("environment/waterlevel", b"2")])
+        self.assertEqual([retain for _, _, retain in self.sent], [True, False])
+
+    def test_config_clears_retained_current_of_removed_devices(self):
+        bridge._current_states.update({"fan": True, "pump": False})
+        self.addCleanup(bridge._current_states.clear)
+        bridge._pending_config = (7, ["fan", "led"])
+        bridge.apply_config_ack(7, 2)
+
+        self.assertEqual(self.sent, [("current/pump", b"", True)])
+        self.assertEqual(set(bridge._current_states), {"fan"})
+
+
+class ShutdownDrainTest(unittest.TestCase):
+
+    def test_io_loop_writes_queued_lines_before_exiting(self):
+        drain_tx()
+        master, slave = os.openpty()
+        self.addCleanup(os.close, master)
+        ser = serial.Serial(os.ttyname(slave), 115200, timeout=0.1)
+        os.close(slave)
+        self.addCleanup(ser.close)
+
+        bridge.enqueue_serial(b'{"cmd":"switch","dev":"fan","val":false}\n')
+        bridge.enqueue_serial(bridge.build_frame(bridge.FRAME_CMD_SWITCH, 1, False))
+        with mock.patch.object(bridge, "shutdown_flag", True):
+            bridge.serial_io_loop(ser)
+        ser.flush()
+
+        self.assertTrue(bridge.ser_tx_q.empty())
+        self.assertEqual(os.read(master, 4096),
+                         b'{"cmd":"switch","dev":"fan","val":false}\n' +
+                         bridge.build_frame(bridge.FRAME_CMD_SWITCH, 1, False))
+
+
+if __name__ == "__main__":
+    unittest.main()